@@ -1,9 +1,14 @@
 """
 Script om markdown rijschema te converteren naar PDF
 """
+import hashlib
 import os
 import re
+import shutil
+import sys
+import time
 
+from reportlab import Version as reportlab_version
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
@@ -27,41 +32,97 @@ def cleanup_pdfs(directory):
 # Input en output paths
 script_dir = os.path.dirname(os.path.abspath(__file__))
 markdown_folder = os.path.join(script_dir, "docs")
-
-# Check for flag files that indicate which markdown files to convert
-flag_files = [file for file in os.listdir(markdown_folder) if file.endswith(".flag")]
-
-if not flag_files:
-    print("No changes detected - no PDF conversion needed")
-    exit(0)
-else:
-    # Clean up PDF files
-    cleanup_pdfs(markdown_folder)
-
-# Collect all markdown files that need to be converted
-markdown_files_to_convert = []
-for flag_file in flag_files:
-    flag_path = os.path.join(markdown_folder, flag_file)
-    with open(flag_path, 'r', encoding='utf-8') as f:
-        files = [
-            line.strip() for line in f.readlines()[:-1]
-            if os.path.exists(os.path.join(script_dir, line.strip()))
-        ]
-        markdown_files_to_convert.extend(files)
-
-print(f"\nConverting {len(markdown_files_to_convert)} markdown file(s) to PDF...")
-
-for markdown_file in markdown_files_to_convert:
+pdf_cache_folder = os.getenv('PDF_CACHE_DIR') or os.path.join(script_dir, ".pdf_cache")
+
+# Bump when the layout changes, so cached PDFs are rendered again
+RENDERER_VERSION = '1'
+
+# Cached PDFs not read or written for this many days are removed
+PDF_CACHE_MAX_AGE_DAYS = float(os.getenv('PDF_CACHE_MAX_AGE_DAYS') or 30)
+
+def get_image_paths(markdown_text):
+    """ Get the absolute paths of logos and images referenced by the markdown """
+    image_paths = re.findall(r'<!-- (?:CLUB|TEAM)_LOGO: (.+) -->', markdown_text)
+    image_paths += re.findall(r'!\[[^\]]*\]\(([^\)]+)\)', markdown_text)
+    return [
+        image_path if os.path.isabs(image_path) else os.path.join(script_dir, image_path)
+        for image_path in image_paths
+    ]
+
+def get_render_cache_key(markdown_text):
+    """ Hash of everything that determines the PDF bytes: markdown, images and renderer """
+    render_hash = hashlib.sha256()
+    render_hash.update(f'{RENDERER_VERSION}\0{reportlab_version}\0'.encode('utf-8'))
+    render_hash.update(markdown_text.encode('utf-8'))
+    for image_path in sorted(get_image_paths(markdown_text)):
+        render_hash.update(f'\0{os.path.relpath(image_path, script_dir)}\0'.encode('utf-8'))
+        if os.path.exists(image_path):
+            with open(image_path, 'rb') as image_file:
+                render_hash.update(image_file.read())
+    return render_hash.hexdigest()
+
+def store_in_render_cache(output_pdf, cached_pdf):
+    """ Copy a rendered PDF into the cache, other writers never see a partial file """
+    try:
+        os.makedirs(pdf_cache_folder, exist_ok=True)
+        temp_pdf = f'{cached_pdf}.{os.getpid()}.tmp'
+        shutil.copyfile(output_pdf, temp_pdf)
+        os.replace(temp_pdf, cached_pdf)
+    except OSError as e:
+        print(f"  Warning: Could not store PDF in cache {cached_pdf}: {e}")
+
+def prune_render_cache(max_age_days=PDF_CACHE_MAX_AGE_DAYS):
+    """ Remove cached PDFs that were not used recently, so the cache stays bounded
+
+    A cache hit refreshes the modification time of the cached PDF, so only
+    entries that no run read or wrote within max_age_days are removed.
+    """
+    if not os.path.exists(pdf_cache_folder):
+        return
+    oldest_allowed = time.time() - max_age_days * 24 * 3600
+    removed = 0
+    for file in os.listdir(pdf_cache_folder):
+        full_path = os.path.join(pdf_cache_folder, file)
+        try:
+            if os.path.getmtime(full_path) < oldest_allowed:
+                os.remove(full_path)
+                removed += 1
+        except OSError as e:
+            print(f"  Could not remove cached PDF {file}: {e}")
+    if removed:
+        print(f"  Removed {removed} unused PDF(s) from cache")
+
+def convert_markdown_to_pdf(markdown_file):
+    """ Convert one markdown driving schedule to PDF, returns the PDF path """
     if not os.path.exists(markdown_file):
         print(f"File not found: {markdown_file}")
-        continue
+        return None
 
     # Lees de markdown file
     with open(markdown_file, 'r', encoding='utf-8') as f:
         markdown_text = f.read()
     output_pdf = markdown_file.replace('.md', '.pdf')
+
+    # Identieke invoer geeft een identieke PDF, dus kopieer uit de cache
+    cached_pdf = os.path.join(pdf_cache_folder, get_render_cache_key(markdown_text) + '.pdf')
+    if os.path.exists(cached_pdf):
+        shutil.copyfile(cached_pdf, output_pdf)
+        # Mark the entry as used, see prune_render_cache
+        os.utime(cached_pdf)
+        print(f"PDF uit cache gekopieerd: {output_pdf}")
+        return output_pdf
+
+    title_match = re.search(r'^# (.+)$', markdown_text, re.MULTILINE)
     # Create PDF document met landscape orientatie voor betere tabel weergave
-    pdf = SimpleDocTemplate(output_pdf, pagesize=landscape(A4))
+    # Invariant mode: fixed dates and a document ID derived from the content
+    pdf = SimpleDocTemplate(
+        output_pdf,
+        pagesize=landscape(A4),
+        invariant=1,
+        title=title_match.group(1).strip() if title_match else '',
+        author='Scheduler',
+        creator='sportlink-driving-schedule',
+    )
     styles = getSampleStyleSheet()
 
     # Custom styles
@@ -101,8 +162,8 @@ for markdown_file in markdown_files_to_convert:
         if line.startswith('<!-- INFO_START -->'):
             i += 1
             info_lines = []
-            CLUB_LOGO_PATH = None
-            TEAM_LOGO_PATH = None
+            club_logo_path = None
+            team_logo_path = None
 
             # Collect info lines until INFO_END
             while i < len(lines) and not lines[i].strip().startswith('<!-- INFO_END -->'):
@@ -114,29 +175,29 @@ for markdown_file in markdown_files_to_convert:
             if i + 1 < len(lines) and lines[i + 1].strip().startswith('<!-- CLUB_LOGO:'):
                 logo_match = re.match(r'<!-- CLUB_LOGO: (.+) -->', lines[i + 1].strip())
                 if logo_match:
-                    CLUB_LOGO_PATH = logo_match.group(1)
+                    club_logo_path = logo_match.group(1)
                     i += 1  # Skip the CLUB_LOGO line
 
             # Check for team logo marker
             if i + 1 < len(lines) and lines[i + 1].strip().startswith('<!-- TEAM_LOGO:'):
                 logo_match = re.match(r'<!-- TEAM_LOGO: (.+) -->', lines[i + 1].strip())
                 if logo_match:
-                    TEAM_LOGO_PATH = logo_match.group(1)
+                    team_logo_path = logo_match.group(1)
                     i += 1  # Skip the TEAM_LOGO line
 
             # Create the info block
-            if CLUB_LOGO_PATH or TEAM_LOGO_PATH:
-                INFO_TEXT = '<br/>'.join(info_lines)
-                info_paragraph = Paragraph(INFO_TEXT, normal_style)
+            if club_logo_path or team_logo_path:
+                info_text = '<br/>'.join(info_lines)
+                info_paragraph = Paragraph(info_text, normal_style)
 
                 # Load logos
                 logos_to_display = []
 
                 # Club logo (will be on the left)
-                if CLUB_LOGO_PATH:
+                if club_logo_path:
                     logo_path_abs = (
-                        CLUB_LOGO_PATH if os.path.isabs(CLUB_LOGO_PATH)
-                        else os.path.join(script_dir, CLUB_LOGO_PATH)
+                        club_logo_path if os.path.isabs(club_logo_path)
+                        else os.path.join(script_dir, club_logo_path)
                     )
                     if os.path.exists(logo_path_abs):
                         try:
@@ -149,10 +210,10 @@ for markdown_file in markdown_files_to_convert:
                             print(f"  Warning: Could not load club logo {logo_path_abs}: {e}")
 
                 # Team logo (will be on the right)
-                if TEAM_LOGO_PATH:
+                if team_logo_path:
                     logo_path_abs = (
-                        TEAM_LOGO_PATH if os.path.isabs(TEAM_LOGO_PATH)
-                        else os.path.join(script_dir, TEAM_LOGO_PATH)
+                        team_logo_path if os.path.isabs(team_logo_path)
+                        else os.path.join(script_dir, team_logo_path)
                     )
                     if os.path.exists(logo_path_abs):
                         try:
@@ -322,5 +383,40 @@ for markdown_file in markdown_files_to_convert:
 
     # Build PDF
     pdf.build(story)
+    store_in_render_cache(output_pdf, cached_pdf)
 
     print(f"PDF succesvol aangemaakt: {output_pdf}")
+    return output_pdf
+
+def main():
+    """ Convert the markdown files of all flagged teams to PDF """
+    # Check for flag files that indicate which markdown files to convert
+    flag_files = [file for file in os.listdir(markdown_folder) if file.endswith(".flag")]
+
+    if not flag_files:
+        print("No changes detected - no PDF conversion needed")
+        sys.exit(0)
+    else:
+        # Clean up PDF files
+        cleanup_pdfs(markdown_folder)
+
+    # Collect all markdown files that need to be converted
+    markdown_files_to_convert = []
+    for flag_file in flag_files:
+        flag_path = os.path.join(markdown_folder, flag_file)
+        with open(flag_path, 'r', encoding='utf-8') as f:
+            files = [
+                line.strip() for line in f.readlines()[:-1]
+                if os.path.exists(os.path.join(script_dir, line.strip()))
+            ]
+            markdown_files_to_convert.extend(files)
+
+    print(f"\nConverting {len(markdown_files_to_convert)} markdown file(s) to PDF...")
+
+    for markdown_file in markdown_files_to_convert:
+        convert_markdown_to_pdf(markdown_file)
+
+    prune_render_cache()
+
+if __name__ == '__main__':
+    main()
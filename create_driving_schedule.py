@@ -1,5 +1,7 @@
 """ Maak rijschema voor team op basis van sportlink kalender en google maps afstand en tijd """
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import argparse
 import os
 import hashlib
 import difflib
@@ -7,9 +9,13 @@ from decimal import Decimal, ROUND_HALF_UP
 import requests
 import icalendar
 from dotenv import load_dotenv
+from team_config import (get_shard_teams, get_team_configs, get_team_slug, is_dated_file,
+                         parse_shard, write_run_report)
 
 load_dotenv()
 
+# Lookups are cached per process, teams sharing an origin reuse each other's routes
+@lru_cache(maxsize=None)
 def get_google_maps_url(place):
     """ Get google maps url """
     url_maps_place = 'https://maps.googleapis.com/maps/api/place/findplacefromtext/json?' + \
@@ -18,10 +24,11 @@ def get_google_maps_url(place):
     response_place = requests.get(url_maps_place, timeout=10).json()['candidates'][0]['place_id']
     return 'https://www.google.com/maps/search/?api=1&query=Google&query_place_id='+ response_place
 
-def get_google_maps_distance_and_duration(place):
-    """ Get google maps distance """
+@lru_cache(maxsize=None)
+def get_google_maps_distance_and_duration(origin, place):
+    """ Get google maps distance from origin to place """
     url_maps_distance = 'https://maps.googleapis.com/maps/api/distancematrix/json?' + \
-        'units=metric&origins=51.4281731,5.3850569&destinations=' + \
+        'units=metric&origins=' + origin + '&destinations=' + \
         place + f'&key={os.getenv("MAPS_API_KEY")}'
     response = requests.get(url_maps_distance, timeout=10).json()
     return response['rows'][0]['elements'][0]['distance']['value'] / 1000, \
@@ -34,8 +41,8 @@ def get_sportlink_calendar(sportlink_calendar_token):
     content = response.content.decode('utf-8')
     return icalendar.Calendar.from_ical(content)
 
-def get_events_from_calendar():
-    """ Get events from calendar """
+def get_events_from_calendar(calendar, base_location, origin, timebefore, travel_cost_per_km):
+    """ Get events from calendar, with the schedule table row of each event """
     events = []
     for event in calendar.walk('VEVENT'):
         summary = event.get('summary')
@@ -52,7 +59,7 @@ def get_events_from_calendar():
             duration_str = '0'
             costs = '€ 0'
         else:
-            distance, duration = get_google_maps_distance_and_duration(location)
+            distance, duration = get_google_maps_distance_and_duration(origin, location)
 
             # calculate colletion time: start - timebefore - time to travel - 5 min
             collection_time = \
@@ -70,10 +77,17 @@ def get_events_from_calendar():
         singleevent = [
             date, weekday, summary, collection_time, start, end, location_link,
             costs, distance_str, duration_str]
-        events.append(singleevent)
+        events.append({
+            'row': singleevent,
+            'uid': str(event.get('uid', '')),
+            'dtstart': event.get('dtstart').dt,
+            'dtend': event.get('dtend').dt,
+            'location': str(location),
+            'url_map': url_map,
+        })
     return events
 
-def get_events_header(language):
+def get_events_header(language, base_location):
     """ Get events header """
     return events_header_list[language].replace("<BASE>", base_location)
 
@@ -82,13 +96,13 @@ def get_content_hash(content):
     return hashlib.md5(content.encode('utf-8')).hexdigest()
 
 def find_old_file(directory, prefix, suffix):
-    """ Find the most recent file matching pattern prefix_*_suffix """
+    """ Find the most recent file matching pattern prefix_YYYY-MM-DD suffix """
     if not os.path.exists(directory):
         return None
 
     matching_files = []
     for file in os.listdir(directory):
-        if file.startswith(prefix) and file.endswith(suffix):
+        if is_dated_file(file, prefix, suffix):
             matching_files.append(os.path.join(directory, file))
 
     if not matching_files:
@@ -130,7 +144,7 @@ def cleanup_old_files(directory, prefix, suffix, keep_file):
         return
 
     for file in os.listdir(directory):
-        if file.startswith(prefix) and file.endswith(suffix):
+        if is_dated_file(file, prefix, suffix):
             full_path = os.path.join(directory, file)
             if full_path != keep_file:
                 try:
@@ -139,13 +153,82 @@ def cleanup_old_files(directory, prefix, suffix, keep_file):
                 except OSError as e:
                     print(f'  Could not remove {file}: {e}')
 
-assert os.getenv('MAPS_API_KEY'), 'MAPS_API_KEY not set'
-assert os.getenv('SPORTLINK_TOKEN_LIST'), 'SPORTLINK_TOKEN_LIST not set'
-assert os.getenv('SPORTLINK_TEAM_LIST'), 'SPORTLINK_TEAM_LIST not set'
-
-# Sportlink - combine token and list
-sportlink_token_list = (os.getenv('SPORTLINK_TOKEN_LIST') or '').split(',')
-sportlink_team_list = (os.getenv('SPORTLINK_TEAM_LIST') or '').split(',')
+def get_ical_time(value):
+    """ Aware times are written as UTC, iCal then needs no VTIMEZONE """
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc)
+    return value
+
+def get_ical_event(team_id, base_location, calendar_event):
+    """ Get VEVENT with collection time, travel and route link in the description """
+    date, _, summary, collection_time, _, _, _, costs, distance_str, duration_str = \
+        calendar_event['row']
+    # Stable UID: the Sportlink UID of the match, prefixed with the team
+    source_uid = calendar_event['uid'] or get_content_hash(f'{date}|{summary}')
+    event = icalendar.Event()
+    event.add('uid', f'{get_team_slug(team_id)}-{source_uid}')
+    event.add('summary', str(summary))
+    event.add('dtstart', get_ical_time(calendar_event['dtstart']))
+    event.add('dtend', get_ical_time(calendar_event['dtend']))
+    event.add('location', calendar_event['location'])
+    event.add('url', calendar_event['url_map'])
+    event.add('description', '\n'.join([
+        f'Verzamelen @{base_location}: {collection_time}',
+        f'Reistijd: {duration_str} min ({distance_str} km)',
+        f'Reiskosten: {costs}',
+        f"Route: {calendar_event['url_map']}",
+    ]))
+    return event
+
+def update_team_ical(ics_path, team_id, base_location, calendar_events):
+    """ Write the iCal feed of a team, rewriting only the events that changed
+
+    Unchanged events keep their DTSTAMP and SEQUENCE, so calendar clients only
+    sync what changed. The file is not touched when nothing changed.
+    """
+    old_events = {}
+    if os.path.exists(ics_path):
+        with open(ics_path, 'rb') as file_ics:
+            for old_event in icalendar.Calendar.from_ical(file_ics.read()).walk('VEVENT'):
+                old_events[str(old_event.get('uid'))] = old_event
+
+    feed = icalendar.Calendar()
+    feed.add('prodid', '-//sportlink-driving-schedule//NL')
+    feed.add('version', '2.0')
+    feed.add('calscale', 'GREGORIAN')
+    feed.add('x-wr-calname', f'Rijschema {team_id}')
+
+    now = datetime.now(timezone.utc)
+    added = 0
+    changed = 0
+    for calendar_event in calendar_events:
+        event = get_ical_event(team_id, base_location, calendar_event)
+        event_hash = get_content_hash(event.to_ical().decode('utf-8'))
+        old_event = old_events.pop(str(event.get('uid')), None)
+        if old_event is not None and str(old_event.get('x-content-hash')) == event_hash:
+            feed.add_component(old_event)
+            continue
+
+        if old_event is None:
+            added += 1
+            event.add('sequence', 0)
+        else:
+            changed += 1
+            event.add('sequence', int(old_event.get('sequence', 0)) + 1)
+        event.add('dtstamp', now)
+        event.add('last-modified', now)
+        event.add('x-content-hash', event_hash)
+        feed.add_component(event)
+    removed = len(old_events)
+
+    if not (added or changed or removed or not os.path.exists(ics_path)):
+        print(f'  iCal feed unchanged: {ics_path}')
+        return False
+
+    with open(ics_path, 'wb') as file_ics:
+        file_ics.write(feed.to_ical())
+    print(f'  iCal feed updated: {ics_path} ({added} added, {changed} changed, {removed} removed)')
+    return True
 
 events_header_list = {
     'en': "| Date | Day | Summary | Time @<BASE> | Start | End | Location | Travel Costs " +  \
@@ -164,119 +247,160 @@ weekday_translation = {
     'Sunday': 'Zondag'
 }
 
-for sportlink_team in sportlink_team_list:
-    team_id = sportlink_team.split(':')[0]
-    base_location = sportlink_team.split(':')[1]
-    warming_up_time = float(sportlink_team.split(':')[2])
-    travel_cost_per_km = float(sportlink_team.split(':')[3])
-    team_email = sportlink_team.split(':')[4] if len(sportlink_team.split(':')) > 4 else ''
-    SPORTLINK_TOKEN = None
-    for sportlink_token in sportlink_token_list:
-        if sportlink_token.startswith(team_id + ':'):
-            SPORTLINK_TOKEN = sportlink_token.split(':')[1]
-            break
-    assert SPORTLINK_TOKEN, f"Sportlink token not found for team {team_id}"
+def process_team(team):
+    """ Create driving schedule markdown for one team config
+
+    Returns (team_id, file_path_nl, file_path_en, team_email) when the content
+    changed and a flag file was written, otherwise None.
+    """
+    team_id = team['team_id']
+    base_location = team['base_location']
+    warming_up_time = team['warming_up_time']
+    travel_cost_per_km = team['travel_cost_per_km']
+    team_email = team['team_email']
+    sportlink_token = team['token']
+    assert sportlink_token, f"Sportlink token not found for team {team_id}"
 
     # Check for team logo
-    logo_filename_base = team_id.lower().replace(' ', '_')
+    logo_filename_base = get_team_slug(team_id)
     logo_team_filename = logo_filename_base + '.team.png'
     logo_club_filename = logo_filename_base + '.club.png'
     logo_team_path = os.path.join('logos', logo_team_filename)
     logo_club_path = os.path.join('logos', logo_club_filename)
     # Use forward slashes for markdown compatibility
-    LOGO_TEAM_PATH_MD = f'logos/{logo_team_filename}'
-    LOGO_CLUB_PATH_MD = f'logos/{logo_club_filename}'
-    HAS_LOGO_TEAM = os.path.exists(logo_team_path)
-    HAS_LOGO_CLUB = os.path.exists(logo_club_path)
+    logo_team_path_md = f'logos/{logo_team_filename}'
+    logo_club_path_md = f'logos/{logo_club_filename}'
+    has_logo_team = os.path.exists(logo_team_path)
+    has_logo_club = os.path.exists(logo_club_path)
 
     print(f'\nProcessing {team_id} @ base: {base_location}')
-    if HAS_LOGO_TEAM:
+    if has_logo_team:
         print(f'  Team logo found: {logo_team_path}')
     else:
         print(f'  No team logo found with expected name: {logo_team_path}')
-    if HAS_LOGO_CLUB:
+    if has_logo_club:
         print(f'  Club logo found: {logo_club_path}')
     else:
         print(f'  No club logo found with expected name: {logo_club_path}')
     # Presence time before game
     timebefore = timedelta(minutes=warming_up_time)
-    calendar = get_sportlink_calendar(SPORTLINK_TOKEN)
-    calendar_events = get_events_from_calendar()
+    calendar = get_sportlink_calendar(sportlink_token)
+    calendar_events = get_events_from_calendar(
+        calendar, base_location, team['origin'], timebefore, travel_cost_per_km)
     # Sort events on date
-    calendar_events.sort(key=lambda x: x[0])
+    calendar_events.sort(key=lambda x: x['row'][0])
+
+    # iCal feed is updated on every run, also when the markdown did not change
+    os.makedirs('docs', exist_ok=True)
+    update_team_ical(f'docs/{logo_filename_base}.ics', team_id, base_location, calendar_events)
 
     today = datetime.now().strftime("%Y-%m-%d")
 
-    FILE_PATH_NL = f'docs/Rijschema_{team_id}_{today}.md'
-    FILE_PATH_EN = f'docs/Drivingschedule_{team_id}_{today}.md'
+    file_path_nl = f'docs/Rijschema_{team_id}_{today}.md'
+    file_path_en = f'docs/Drivingschedule_{team_id}_{today}.md'
     # Ensure the directories exist
-    docs_dir = os.path.dirname(FILE_PATH_NL)
+    docs_dir = os.path.dirname(file_path_nl)
     os.makedirs(docs_dir, exist_ok=True)
 
     # Build content first to check if it changed
-    CONTENT_EN = f'# Driving schedule {team_id}\n\n'
+    content_en = f'# Driving schedule {team_id}\n\n'
     # Info block with optional logos on the right
-    CONTENT_EN += '<!-- INFO_START -->\n'
-    CONTENT_EN += f'Base location: {base_location}\n\n'
-    CONTENT_EN += f'Warming Up Time: {timebefore}\n\n'
-    CONTENT_EN += f'Cost per km: €{travel_cost_per_km}\n'
-    CONTENT_EN += '<!-- INFO_END -->\n'
-    if HAS_LOGO_CLUB:
-        CONTENT_EN += f'<!-- CLUB_LOGO: {LOGO_CLUB_PATH_MD} -->\n'
-    if HAS_LOGO_TEAM:
-        CONTENT_EN += f'<!-- TEAM_LOGO: {LOGO_TEAM_PATH_MD} -->\n'
-    CONTENT_EN += '\n'
-    CONTENT_EN += get_events_header('en')
-    CONTENT_EN += '| --- | --- | --- | --- | --- | --- | --- | --- | --- | --- |\n'
+    content_en += '<!-- INFO_START -->\n'
+    content_en += f'Base location: {base_location}\n\n'
+    content_en += f'Warming Up Time: {timebefore}\n\n'
+    content_en += f'Cost per km: €{travel_cost_per_km}\n'
+    content_en += '<!-- INFO_END -->\n'
+    if has_logo_club:
+        content_en += f'<!-- CLUB_LOGO: {logo_club_path_md} -->\n'
+    if has_logo_team:
+        content_en += f'<!-- TEAM_LOGO: {logo_team_path_md} -->\n'
+    content_en += '\n'
+    content_en += get_events_header('en', base_location)
+    content_en += '| --- | --- | --- | --- | --- | --- | --- | --- | --- | --- |\n'
     for calendar_event in calendar_events:
-        CONTENT_EN += '| ' + ' | '.join(calendar_event) + ' |\n'
+        content_en += '| ' + ' | '.join(calendar_event['row']) + ' |\n'
 
-    CONTENT_NL = f'# Rijschema {team_id}\n\n'
+    content_nl = f'# Rijschema {team_id}\n\n'
     # Info block with optional logos on the right
-    CONTENT_NL += '<!-- INFO_START -->\n'
-    CONTENT_NL += f'Basis locatie: {base_location}\n\n'
-    CONTENT_NL += f'Warming Up Tijd: {timebefore}\n\n'
-    CONTENT_NL += f'Kosten per km: €{travel_cost_per_km}\n'
-    CONTENT_NL += '<!-- INFO_END -->\n'
-    if HAS_LOGO_CLUB:
-        CONTENT_NL += f'<!-- CLUB_LOGO: {LOGO_CLUB_PATH_MD} -->\n'
-    if HAS_LOGO_TEAM:
-        CONTENT_NL += f'<!-- TEAM_LOGO: {LOGO_TEAM_PATH_MD} -->\n'
-    CONTENT_NL += '\n'
-    CONTENT_NL += get_events_header('nl')
-    CONTENT_NL += '| --- | --- | --- | --- | --- | --- | --- | --- | --- | --- |\n'
+    content_nl += '<!-- INFO_START -->\n'
+    content_nl += f'Basis locatie: {base_location}\n\n'
+    content_nl += f'Warming Up Tijd: {timebefore}\n\n'
+    content_nl += f'Kosten per km: €{travel_cost_per_km}\n'
+    content_nl += '<!-- INFO_END -->\n'
+    if has_logo_club:
+        content_nl += f'<!-- CLUB_LOGO: {logo_club_path_md} -->\n'
+    if has_logo_team:
+        content_nl += f'<!-- TEAM_LOGO: {logo_team_path_md} -->\n'
+    content_nl += '\n'
+    content_nl += get_events_header('nl', base_location)
+    content_nl += '| --- | --- | --- | --- | --- | --- | --- | --- | --- | --- |\n'
     for calendar_event in calendar_events:
-        calendar_event[1] = weekday_translation[calendar_event[1]]
-        CONTENT_NL += '| ' + ' | '.join(calendar_event) + ' |\n'
+        calendar_event['row'][1] = weekday_translation[calendar_event['row'][1]]
+        content_nl += '| ' + ' | '.join(calendar_event['row']) + ' |\n'
 
     # Check if content changed by comparing with old files (if they exist)
     old_content_nl = get_markdown_content(docs_dir, f'Rijschema_{team_id}')
     old_content_en = get_markdown_content(docs_dir, f'Drivingschedule_{team_id}')
-    CHANGED_NL = has_content_changed(old_content_nl, CONTENT_NL)
-    CHANGED_EN = has_content_changed(old_content_en, CONTENT_EN)
+    changed_nl = has_content_changed(old_content_nl, content_nl)
+    changed_en = has_content_changed(old_content_en, content_en)
 
     # Only create flag file if content changed (to trigger PDF conversion)
-    if CHANGED_NL or CHANGED_EN:
-        if CHANGED_NL:
+    if changed_nl or changed_en:
+        if changed_nl:
             print('  Dutch content changed - will update file and trigger PDF conversion')
-            print_content_diff(old_content_nl, CONTENT_NL, f'old_Rijschema_{team_id}', f'new_Rijschema_{team_id}')
-        if CHANGED_EN:
+            print_content_diff(old_content_nl, content_nl, f'old_Rijschema_{team_id}', f'new_Rijschema_{team_id}')
+        if changed_en:
             print('  English content changed - will update file and trigger PDF conversion')
-            print_content_diff(old_content_en, CONTENT_EN, f'old_Drivingschedule_{team_id}', f'new_Drivingschedule_{team_id}')
+            print_content_diff(old_content_en, content_en, f'old_Drivingschedule_{team_id}', f'new_Drivingschedule_{team_id}')
 
         # Clean up old files with different dates
-        cleanup_old_files(docs_dir, f'Rijschema_{team_id}', '.md', FILE_PATH_NL)
-        cleanup_old_files(docs_dir, f'Drivingschedule_{team_id}', '.md', FILE_PATH_EN)
+        cleanup_old_files(docs_dir, f'Rijschema_{team_id}', '.md', file_path_nl)
+        cleanup_old_files(docs_dir, f'Drivingschedule_{team_id}', '.md', file_path_en)
 
-        with open(FILE_PATH_NL, 'w', encoding='utf-8') as file_nl:
-            file_nl.write(CONTENT_NL)
+        with open(file_path_nl, 'w', encoding='utf-8') as file_nl:
+            file_nl.write(content_nl)
 
-        with open(FILE_PATH_EN, 'w', encoding='utf-8') as file_en:
-            file_en.write(CONTENT_EN)
+        with open(file_path_en, 'w', encoding='utf-8') as file_en:
+            file_en.write(content_en)
 
-        FLAG_FILE = f'docs/.convert_to_pdf_{team_id}.flag'
+        flag_file = f'docs/.convert_to_pdf_{team_id}.flag'
         print('  Content changed - flag file created for PDF conversion')
-        with open(FLAG_FILE, 'w', encoding='utf-8') as f:
-            f.write(f'{FILE_PATH_NL}\n{FILE_PATH_EN}\n{team_email}\n')
-    else:
-        print('  No changes detected - PDF conversion not needed')
+        with open(flag_file, 'w', encoding='utf-8') as f:
+            f.write(f'{file_path_nl}\n{file_path_en}\n{team_email}\n')
+        return team_id, file_path_nl, file_path_en, team_email
+
+    print('  No changes detected - PDF conversion not needed')
+    return None
+
+def get_argument_parser(description):
+    """ Get parser for the arguments shared with the pipeline """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--config',
+                        help='JSON file with clubs and teams (default: SPORTLINK_CONFIG_FILE, '
+                             'otherwise SPORTLINK_TEAM_LIST)')
+    parser.add_argument('--shard', type=parse_shard,
+                        help='only process shard i of N, like 1/4')
+    return parser
+
+def get_teams_to_process(args):
+    """ Get the team configs of this run, limited to the shard if given """
+    teams = get_team_configs(args.config)
+    if args.shard:
+        teams = get_shard_teams(teams, *args.shard)
+        print(f'Shard {args.shard[0]}/{args.shard[1]}: {len(teams)} team(s)')
+    return teams
+
+def main():
+    """ Create driving schedules for all configured teams """
+    args = get_argument_parser(__doc__.strip()).parse_args()
+    assert os.getenv('MAPS_API_KEY'), 'MAPS_API_KEY not set'
+
+    results = {}
+    for team in get_teams_to_process(args):
+        changed_team = process_team(team)
+        results[team['team_id']] = 'changed' if changed_team else 'unchanged'
+
+    write_run_report('docs', args.shard, results)
+
+if __name__ == '__main__':
+    main()
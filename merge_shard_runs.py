@@ -0,0 +1,142 @@
+"""
+Script to merge the output of sharded runs into one docs folder and run report
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+
+from team_config import get_run_report_path, is_team_file
+
+def load_shard_reports(shard_dir):
+    """ Load the shard run reports found in one shard folder """
+    reports = []
+    for report_path in sorted(glob.glob(os.path.join(shard_dir, 'run_report.shard-*.json'))):
+        with open(report_path, 'r', encoding='utf-8') as f:
+            reports.append((report_path, json.load(f)))
+    return reports
+
+def get_shard_files(shard_dir, team_ids):
+    """ Get the files of a shard folder that belong to the teams of that shard
+
+    A shard folder also holds older copies of the other shards' teams (from
+    the previous artifact); those are never taken from this shard.
+    """
+    shard_files = []
+    for file in sorted(os.listdir(shard_dir)):
+        if os.path.isfile(os.path.join(shard_dir, file)) and \
+                any(is_team_file(file, team_id) for team_id in team_ids):
+            shard_files.append(file)
+    return shard_files
+
+def plan_copies(shard_dirs, output_dir):
+    """ Map each target file to its source, returns (copies, problems) """
+    copies = {}
+    problems = []
+    for shard_dir in shard_dirs:
+        # A shard without teams (more shards than teams) adds no files;
+        # missing reports are detected by merge_reports
+        team_ids = set()
+        for _, report in load_shard_reports(shard_dir):
+            team_ids.update(report['teams'])
+        for file in get_shard_files(shard_dir, team_ids):
+            source = os.path.join(shard_dir, file)
+            target = os.path.join(output_dir, file)
+            if target in copies:
+                problems.append(f"{file} written by {copies[target]} and {source}")
+                continue
+            copies[target] = source
+    return copies, problems
+
+def merge_reports(reports):
+    """ Merge shard reports, returns (merged report, list of problems) """
+    problems = []
+    teams = {}
+    team_shard = {}
+    shard_counts = set()
+    shard_indexes = set()
+    for report_path, report in reports:
+        shard_index, shard_count = (int(part) for part in report['shard'].split('/'))
+        shard_counts.add(shard_count)
+        if shard_index in shard_indexes:
+            problems.append(f"Shard {report['shard']} reported twice ({report_path})")
+        shard_indexes.add(shard_index)
+        for team_id, status in report['teams'].items():
+            if team_id in team_shard:
+                problems.append(
+                    f"Team {team_id} in shard {team_shard[team_id]} and {report['shard']}")
+            team_shard[team_id] = report['shard']
+            teams[team_id] = status
+
+    if len(shard_counts) > 1:
+        problems.append(f"Shard reports disagree on the number of shards: {sorted(shard_counts)}")
+    shard_count = max(shard_counts) if shard_counts else 0
+    missing = sorted(set(range(1, shard_count + 1)) - shard_indexes)
+    if missing:
+        problems.append(f"Missing shard report(s): {', '.join(map(str, missing))} of {shard_count}")
+
+    merged = {
+        'shard': None,
+        'shards': shard_count,
+        'teams': dict(sorted(teams.items())),
+    }
+    return merged, problems
+
+def remove_stale_files(output_dir, team_ids, copies):
+    """ Remove files of the merged teams in the output that no shard produced """
+    for file in os.listdir(output_dir):
+        target = os.path.join(output_dir, file)
+        if target not in copies and any(is_team_file(file, team_id) for team_id in team_ids):
+            os.remove(target)
+            print(f"  Removed old file: {file}")
+
+def main():
+    """ Merge shard folders into the output folder """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('shard_dirs', nargs='+', help='docs folders of the shard runs')
+    parser.add_argument('--output', default='docs', help='merged docs folder (default: docs)')
+    args = parser.parse_args()
+
+    reports = [report for shard_dir in args.shard_dirs for report in load_shard_reports(shard_dir)]
+    if not reports:
+        print("ERROR: No shard run reports found")
+        sys.exit(1)
+
+    merged, problems = merge_reports(reports)
+    copies, copy_problems = plan_copies(args.shard_dirs, args.output)
+    problems += copy_problems
+    if problems:
+        for problem in problems:
+            print(f"  ERROR: {problem}")
+        print("Nothing merged")
+        sys.exit(1)
+
+    os.makedirs(args.output, exist_ok=True)
+    shard_dirs = {os.path.abspath(shard_dir) for shard_dir in args.shard_dirs}
+    if os.path.abspath(args.output) not in shard_dirs:
+        remove_stale_files(args.output, merged['teams'], copies)
+    for target, source in copies.items():
+        if os.path.abspath(source) != os.path.abspath(target):
+            # copy2 keeps the modification time, used to find the latest schedule
+            shutil.copy2(source, target)
+    print(f"  Copied {len(copies)} file(s) from {len(args.shard_dirs)} shard folder(s)")
+
+    report_path = get_run_report_path(args.output)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(merged, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+
+    print(f"\n{'='*50}")
+    print(f"Merged {len(reports)} shard report(s) with {len(merged['teams'])} team(s)")
+    for team_id, status in merged['teams'].items():
+        print(f"  {team_id}: {status}")
+    print(f"{'='*50}")
+
+    failed = [status for status in merged['teams'].values() if status.startswith('failed')]
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+Script to create, convert and mail driving schedules as one pipeline
+
+Teams flow through three stages connected by bounded queues: schedule
+(fetch Sportlink calendar and Google Maps routes, write markdown), render
+(markdown to PDF) and mail. A team's PDFs are rendered while other teams are
+still being fetched, and its email is sent as soon as its PDFs exist.
+"""
+from contextlib import contextmanager
+import io
+import os
+import queue
+import sys
+import threading
+import time
+
+from create_driving_schedule import (cleanup_old_files, get_argument_parser,
+                                     get_teams_to_process, process_team)
+from convert_driving_schedule_to_pdf import convert_markdown_to_pdf, prune_render_cache
+from send_team_emails import get_email_settings, get_team_pdf_files, send_team_email
+from team_config import write_run_report
+
+# Marks the end of the work in a queue
+STOP = None
+
+class TeamLog:
+    """ sys.stdout replacement that buffers what a thread prints for one team
+
+    Teams are handled by several threads at the same time; each team's output
+    (including the content diff) is printed in one block when it is done.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def write(self, text):
+        """ Write to the buffer of the current team, or directly outside a team """
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is not None:
+            return buffer.write(text)
+        with self.lock:
+            return self.stream.write(text)
+
+    def flush(self):
+        """ Flush the underlying stream """
+        with self.lock:
+            self.stream.flush()
+
+    @contextmanager
+    def team(self, team_id, stage):
+        """ Buffer the output of one stage of a team and print it at the end """
+        self.local.buffer = io.StringIO()
+        try:
+            yield
+        finally:
+            text = self.local.buffer.getvalue()
+            self.local.buffer = None
+            with self.lock:
+                self.stream.write(f"\n[{team_id}] {stage}\n{text.lstrip(chr(10))}")
+                self.stream.flush()
+
+def discard_team_markdown(team_id, file_paths):
+    """ Remove the new markdown and flag file of a team that was not delivered
+
+    Without the markdown the next run sees the schedule as changed and renders
+    and mails it again, instead of treating the update as already handled.
+    """
+    for file_path in file_paths + [f'docs/.convert_to_pdf_{team_id}.flag']:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            print(f"  Removed {file_path}, {team_id} is retried in the next run")
+
+class PipelineSummary:
+    """ Thread safe collection of the outcome per team """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = {}
+
+    def set(self, team_id, status):
+        """ Record the latest status of a team """
+        with self.lock:
+            self.results[team_id] = status
+
+    def print_summary(self, elapsed):
+        """ Print the final summary """
+        print(f"\n{'='*50}")
+        print(f"Pipeline summary ({elapsed:.1f}s)")
+        for team_id, status in sorted(self.results.items()):
+            print(f"  {team_id}: {status}")
+        print(f"{'='*50}")
+
+    def count(self, prefix):
+        """ Count teams whose status starts with prefix """
+        with self.lock:
+            return sum(1 for status in self.results.values() if status.startswith(prefix))
+
+def schedule_worker(team_queue, render_queue, summary, team_log):
+    """ Fetch and compute schedules, pass changed teams to the render stage """
+    while True:
+        try:
+            team = team_queue.get_nowait()
+        except queue.Empty:
+            return
+        team_id = team['team_id']
+        with team_log.team(team_id, 'schedule'):
+            try:
+                changed_team = process_team(team)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"  ERROR creating schedule for {team_id}: {e}")
+                summary.set(team_id, f'failed (schedule): {e}')
+                continue
+        if changed_team is None:
+            summary.set(team_id, 'unchanged')
+            continue
+        summary.set(team_id, 'changed')
+        # Blocks while the render stage is behind (backpressure)
+        render_queue.put(changed_team)
+
+def render_worker(render_queue, mail_queue, summary, team_log):
+    """ Render PDFs of changed teams, pass them to the mail stage """
+    while True:
+        changed_team = render_queue.get()
+        if changed_team is STOP:
+            mail_queue.put(STOP)
+            return
+        team_id, file_path_nl, file_path_en, team_email = changed_team
+        with team_log.team(team_id, 'render'):
+            try:
+                docs_dir = os.path.dirname(file_path_nl)
+                cleanup_old_files(docs_dir, f'Rijschema_{team_id}', '.pdf',
+                                  file_path_nl.replace('.md', '.pdf'))
+                cleanup_old_files(docs_dir, f'Drivingschedule_{team_id}', '.pdf',
+                                  file_path_en.replace('.md', '.pdf'))
+                convert_markdown_to_pdf(file_path_nl)
+                convert_markdown_to_pdf(file_path_en)
+                pdf_files = get_team_pdf_files(file_path_nl, file_path_en)
+                assert pdf_files, f"No PDF files created for {team_id}"
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"  ERROR rendering PDF for {team_id}: {e}")
+                summary.set(team_id, f'failed (render): {e}')
+                discard_team_markdown(team_id, [file_path_nl, file_path_en])
+                continue
+        summary.set(team_id, 'rendered')
+        mail_queue.put((team_id, team_email, [file_path_nl, file_path_en], pdf_files))
+
+def mail_worker(mail_queue, email_settings, summary, team_log):
+    """ Send the rendered PDFs per team """
+    while True:
+        rendered_team = mail_queue.get()
+        if rendered_team is STOP:
+            return
+        team_id, team_email, markdown_files, pdf_files = rendered_team
+        if email_settings is None:
+            continue
+        with team_log.team(team_id, 'mail'):
+            flag_file = f'docs/.convert_to_pdf_{team_id}.flag'
+            if not team_email.strip():
+                # Handled by this run as well, like send_team_emails.py does
+                if os.path.exists(flag_file):
+                    os.remove(flag_file)
+                print(f"  Skipping email for {team_id} - no recipient configured")
+                summary.set(team_id, 'rendered, no recipient')
+                continue
+            if not email_settings[0] or not email_settings[1]:
+                print("  ERROR: EMAIL_USERNAME and EMAIL_PASSWORD must be set (or use --skip-email)")
+                summary.set(team_id, 'failed (mail): EMAIL_USERNAME and EMAIL_PASSWORD not set')
+                discard_team_markdown(team_id, markdown_files)
+                continue
+            try:
+                # Remove the flag file, the team is handled by this run
+                if os.path.exists(flag_file):
+                    os.remove(flag_file)
+                sent = send_team_email(team_id, team_email, pdf_files, email_settings)
+                assert sent, f"Email to {team_email} not sent"
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"  ERROR sending email for {team_id}: {e}")
+                summary.set(team_id, f'failed (mail): {e}')
+                discard_team_markdown(team_id, markdown_files)
+                continue
+        summary.set(team_id, 'sent')
+
+def run_pipeline(teams, email_settings, workers=4, queue_size=4):
+    """ Run all teams through the schedule, render and mail stages """
+    summary = PipelineSummary()
+    team_log = TeamLog(sys.stdout)
+    team_queue = queue.Queue()
+    for team in teams:
+        team_queue.put(team)
+    render_queue = queue.Queue(maxsize=queue_size)
+    mail_queue = queue.Queue(maxsize=queue_size)
+
+    schedule_threads = [
+        threading.Thread(target=schedule_worker,
+                         args=(team_queue, render_queue, summary, team_log))
+        for _ in range(max(1, min(workers, len(teams))))
+    ]
+    render_thread = threading.Thread(target=render_worker,
+                                     args=(render_queue, mail_queue, summary, team_log))
+    mail_thread = threading.Thread(target=mail_worker,
+                                   args=(mail_queue, email_settings, summary, team_log))
+
+    sys.stdout = team_log
+    try:
+        for thread in schedule_threads + [render_thread, mail_thread]:
+            thread.start()
+        for thread in schedule_threads:
+            thread.join()
+        render_queue.put(STOP)
+        render_thread.join()
+        mail_thread.join()
+    finally:
+        sys.stdout = team_log.stream
+    return summary
+
+def main():
+    """ Run the driving schedule pipeline for all configured teams """
+    parser = get_argument_parser(__doc__.strip().split('\n', 1)[0])
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of teams fetched in parallel (default: 4)')
+    parser.add_argument('--queue-size', type=int, default=4,
+                        help='maximum number of teams waiting between stages (default: 4)')
+    parser.add_argument('--skip-email', action='store_true',
+                        help='create and render only, keep flag files for send_team_emails.py')
+    args = parser.parse_args()
+
+    assert os.getenv('MAPS_API_KEY'), 'MAPS_API_KEY not set'
+    teams = get_teams_to_process(args)
+
+    # Credentials are checked in the mail stage, a run without changes needs none
+    email_settings = None if args.skip_email else get_email_settings()
+
+    start = time.monotonic()
+    summary = run_pipeline(teams, email_settings,
+                           workers=args.workers, queue_size=args.queue_size)
+    summary.print_summary(time.monotonic() - start)
+    prune_render_cache()
+    write_run_report('docs', args.shard, summary.results)
+
+    if summary.count('failed'):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
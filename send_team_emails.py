@@ -49,7 +49,7 @@ def send_email(
     msg.attach(MIMEText(email_body, 'plain'))
 
     # Attach PDF files
-    for pdf_file in pdf_files:
+    for pdf_file in email_pdf_files:
         if os.path.exists(pdf_file):
             with open(pdf_file, 'rb') as file_email:
                 pdf_attachment = MIMEApplication(file_email.read(), _subtype='pdf')
@@ -69,89 +69,107 @@ def send_email(
         print(f"  Failed to send email to {email_to}: {e}")
         return False
 
-# Get email credentials from environment
-username = os.getenv('EMAIL_USERNAME')
-password = os.getenv('EMAIL_PASSWORD')
-mail_from = os.getenv('EMAIL_FROM', username)
-email_subject_prefix = os.getenv('EMAIL_SUBJECT', 'Driving Schedule')
+def get_email_settings():
+    """ Get email credentials and subject prefix from environment """
+    username = os.getenv('EMAIL_USERNAME')
+    password = os.getenv('EMAIL_PASSWORD')
+    mail_from = os.getenv('EMAIL_FROM', username)
+    email_subject_prefix = os.getenv('EMAIL_SUBJECT', 'Driving Schedule')
+    return username, password, mail_from, email_subject_prefix
 
-if not username or not password:
-    print("ERROR: EMAIL_USERNAME and EMAIL_PASSWORD must be set")
-    sys.exit(1)
+def send_team_email(team_id, team_email, pdf_files, email_settings):
+    """ Send the driving schedule PDFs of one team """
+    username, password, mail_from, email_subject_prefix = email_settings
+
+    # Prepare email
+    subject = f"{email_subject_prefix} - {team_id} - {datetime.now().strftime('%Y-%m-%d')}"
+    body = f"""New driving schedule generated for {team_id}!
+
+See the attached PDF file(s).
+
+Generated: {datetime.now().strftime('%Y-%m-%d %H:%M')}
+"""
+
+    # Send email
+    return send_email(team_email,
+                      subject,
+                      body,
+                      pdf_files,
+                      email_from=mail_from,
+                      scheduler_id=team_id,
+                      smtp_username=username,
+                      smtp_password=password)
+
+def get_team_pdf_files(nl_file, en_file):
+    """ Get the existing PDF files belonging to the markdown files of a team """
+    pdf_files = []
+    for markdown_file in (nl_file, en_file):
+        pdf_file = markdown_file.replace('.md', '.pdf')
+        if os.path.exists(pdf_file):
+            pdf_files.append(pdf_file)
+    return pdf_files
 
 # Input paths
 script_dir = os.path.dirname(os.path.abspath(__file__))
 handbal_folder = os.path.join(script_dir, "docs")
 
-# Check for flag files that indicate which teams have changes
-flag_files = [file for file in os.listdir(handbal_folder) if file.endswith(".flag")]
+def main():
+    """ Send emails for all flagged teams """
+    email_settings = get_email_settings()
+    username, password, _, _ = email_settings
 
-if not flag_files:
-    print("No flag files found - no emails to send")
-    sys.exit(0)
+    if not username or not password:
+        print("ERROR: EMAIL_USERNAME and EMAIL_PASSWORD must be set")
+        sys.exit(1)
 
-print(f"\nFound {len(flag_files)} team(s) with changes")
+    # Check for flag files that indicate which teams have changes
+    flag_files = [file for file in os.listdir(handbal_folder) if file.endswith(".flag")]
 
-# Process each team
-EMAILS_SENT = 0
-for flag_file in flag_files:
-    flag_path = os.path.join(handbal_folder, flag_file)
-    team_id = flag_file.replace('.convert_to_pdf_', '').replace('.flag', '')
+    if not flag_files:
+        print("No flag files found - no emails to send")
+        sys.exit(0)
 
-    print(f"\nProcessing team: {team_id}")
+    print(f"\nFound {len(flag_files)} team(s) with changes")
 
-    with open(flag_path, 'r', encoding='utf-8') as f:
-        lines = [line.strip() for line in f.readlines()]
+    # Process each team
+    emails_sent = 0
+    for flag_file in flag_files:
+        flag_path = os.path.join(handbal_folder, flag_file)
+        team_id = flag_file.replace('.convert_to_pdf_', '').replace('.flag', '')
 
-    # Remove the flag file after reading
-    os.remove(flag_path)
-    print(f"  Flag file removed: {flag_file}")
+        print(f"\nProcessing team: {team_id}")
 
-    if len(lines) < 3:
-        print(f"  WARNING: Flag file incomplete for {team_id}")
-        continue
+        with open(flag_path, 'r', encoding='utf-8') as f:
+            lines = [line.strip() for line in f.readlines()]
 
-    nl_file = lines[0]
-    en_file = lines[1]
-    team_email = lines[2] if len(lines) > 2 else ''
+        # Remove the flag file after reading
+        os.remove(flag_path)
+        print(f"  Flag file removed: {flag_file}")
 
-    # Get corresponding PDF files
-    pdf_nl = nl_file.replace('.md', '.pdf')
-    pdf_en = en_file.replace('.md', '.pdf')
+        if len(lines) < 3:
+            print(f"  WARNING: Flag file incomplete for {team_id}")
+            continue
 
-    pdf_files = []
-    if os.path.exists(pdf_nl):
-        pdf_files.append(pdf_nl)
-    if os.path.exists(pdf_en):
-        pdf_files.append(pdf_en)
+        nl_file = lines[0]
+        en_file = lines[1]
+        team_email = lines[2] if len(lines) > 2 else ''
 
-    if not pdf_files:
-        print(f"  WARNING: No PDF files found for {team_id}")
-        continue
+        # Get corresponding PDF files
+        pdf_files = get_team_pdf_files(nl_file, en_file)
 
-    # Prepare email
-    SUBJECT = f"{email_subject_prefix} - {team_id} - {datetime.now().strftime('%Y-%m-%d')}"
-    BODY = f"""New driving schedule generated for {team_id}!
+        if not pdf_files:
+            print(f"  WARNING: No PDF files found for {team_id}")
+            continue
 
-See the attached PDF file(s).
+        if send_team_email(team_id, team_email, pdf_files, email_settings):
+            emails_sent += 1
 
-Generated: {datetime.now().strftime('%Y-%m-%d %H:%M')}
-"""
+    print(f"\n{'='*50}")
+    print(f"Email summary: {emails_sent} email(s) sent successfully")
+    print(f"{'='*50}")
 
-    # Send email
-    if send_email(team_email,
-                  SUBJECT,
-                  BODY,
-                  pdf_files,
-                  email_from=mail_from,
-                  scheduler_id=team_id,
-                  smtp_username=username,
-                  smtp_password=password):
-        EMAILS_SENT += 1
-
-print(f"\n{'='*50}")
-print(f"Email summary: {EMAILS_SENT} email(s) sent successfully")
-print(f"{'='*50}")
-
-if EMAILS_SENT == 0:
-    sys.exit(1)
+    if emails_sent == 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
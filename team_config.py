@@ -0,0 +1,176 @@
+"""
+Team configuration from environment strings or a clubs config file, and
+deterministic sharding of teams over multiple workers
+"""
+import json
+import math
+import os
+import re
+
+# Origin of the routes for teams from SPORTLINK_TEAM_LIST without MAPS_ORIGIN
+DEFAULT_ORIGIN = '51.4281731,5.3850569'
+
+def parse_token_list(sportlink_token_list):
+    """ Map team id to Sportlink token from TEAM_ID:token entries """
+    tokens = {}
+    for token_entry in sportlink_token_list:
+        if ':' in token_entry:
+            team_id, token = token_entry.split(':', 1)
+            tokens[team_id] = token
+    return tokens
+
+def parse_team_list(sportlink_team_list, tokens):
+    """ Get team configs from TEAM_ID:BASE_LOCATION:WARMUP:COST_PER_KM:EMAIL entries """
+    origin = os.getenv('MAPS_ORIGIN') or DEFAULT_ORIGIN
+    teams = []
+    for sportlink_team in sportlink_team_list:
+        fields = sportlink_team.split(':')
+        teams.append({
+            'team_id': fields[0],
+            'club': '',
+            'base_location': fields[1],
+            'origin': origin,
+            'warming_up_time': float(fields[2]),
+            'travel_cost_per_km': float(fields[3]),
+            'team_email': fields[4] if len(fields) > 4 else '',
+            'token': tokens.get(fields[0]),
+        })
+    return teams
+
+def load_config_file(config_file, tokens):
+    """ Get team configs from a JSON file with clubs and their teams
+
+    Club level settings (base_location, origin, warming_up_time,
+    travel_cost_per_km) apply to all teams of the club unless the team
+    overrides them. Routes start at origin, an address or lat,lng, which
+    defaults to base_location. A team without a token gets it from
+    SPORTLINK_TOKEN_LIST.
+    """
+    with open(config_file, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    assert isinstance(config.get('clubs'), list), f"{config_file}: 'clubs' list missing"
+
+    teams = []
+    for club_number, club in enumerate(config['clubs'], start=1):
+        club_name = club.get('name') or f'#{club_number}'
+        assert isinstance(club.get('teams'), list), f"Club {club_name}: 'teams' list missing"
+        for team_number, team in enumerate(club['teams'], start=1):
+            team_id = team.get('team_id')
+            assert team_id, f"Club {club_name}, team #{team_number}: 'team_id' missing"
+            settings = {}
+            for key in ('base_location', 'warming_up_time', 'travel_cost_per_km'):
+                value = team.get(key, club.get(key))
+                assert value not in (None, ''), \
+                    f"Club {club_name}, team {team_id}: '{key}' missing on club and team"
+                settings[key] = value
+            try:
+                warming_up_time = float(settings['warming_up_time'])
+                travel_cost_per_km = float(settings['travel_cost_per_km'])
+            except (TypeError, ValueError) as e:
+                raise AssertionError(
+                    f"Club {club_name}, team {team_id}: "
+                    "'warming_up_time' and 'travel_cost_per_km' must be numbers") from e
+            teams.append({
+                'team_id': team_id,
+                'club': club.get('name', ''),
+                'base_location': str(settings['base_location']),
+                'origin': str(team.get('origin') or club.get('origin')
+                              or settings['base_location']),
+                'warming_up_time': warming_up_time,
+                'travel_cost_per_km': travel_cost_per_km,
+                'team_email': team.get('email', ''),
+                'token': team.get('token', tokens.get(team_id)),
+            })
+    return teams
+
+def get_team_configs(config_file=None):
+    """ Get team configs from the config file if given, otherwise from environment """
+    tokens = parse_token_list((os.getenv('SPORTLINK_TOKEN_LIST') or '').split(','))
+    config_file = config_file or os.getenv('SPORTLINK_CONFIG_FILE')
+    if config_file:
+        teams = load_config_file(config_file, tokens)
+    else:
+        assert os.getenv('SPORTLINK_TOKEN_LIST'), 'SPORTLINK_TOKEN_LIST not set'
+        assert os.getenv('SPORTLINK_TEAM_LIST'), 'SPORTLINK_TEAM_LIST not set'
+        teams = parse_team_list((os.getenv('SPORTLINK_TEAM_LIST') or '').split(','), tokens)
+
+    team_ids = [team['team_id'] for team in teams]
+    duplicates = sorted({team_id for team_id in team_ids if team_ids.count(team_id) > 1})
+    assert not duplicates, f"Duplicate team ids in configuration: {', '.join(duplicates)}"
+    return teams
+
+def parse_shard(shard):
+    """ Parse a shard argument like 2/4 into (2, 4), shards are numbered from 1 """
+    try:
+        shard_index, shard_count = (int(part) for part in shard.split('/'))
+    except ValueError as e:
+        raise ValueError(f"Invalid shard '{shard}', expected i/N like 1/4") from e
+    if not 1 <= shard_index <= shard_count:
+        raise ValueError(f"Invalid shard '{shard}', i must be between 1 and N")
+    return shard_index, shard_count
+
+def get_venue_key(team):
+    """ Teams with the same route origin share most away venues and cached routes """
+    return team['origin'].strip().lower()
+
+def get_shard_teams(teams, shard_index, shard_count):
+    """ Get the teams of one shard
+
+    Teams are grouped per venue so the route cache of a worker is shared by
+    teams that travel to the same places. Groups larger than a fair share are
+    split, then the groups are assigned largest first to the least loaded
+    shard. The result only depends on the configuration, so every worker
+    computes the same partition.
+    """
+    groups = {}
+    for team in teams:
+        groups.setdefault(get_venue_key(team), []).append(team)
+
+    max_group_size = max(1, math.ceil(len(teams) / shard_count))
+    chunks = []
+    for venue_key in sorted(groups):
+        members = sorted(groups[venue_key], key=lambda team: team['team_id'])
+        for start in range(0, len(members), max_group_size):
+            chunks.append(members[start:start + max_group_size])
+    chunks.sort(key=lambda chunk: (-len(chunk), chunk[0]['team_id']))
+
+    shards = [[] for _ in range(shard_count)]
+    for chunk in chunks:
+        target = min(range(shard_count), key=lambda shard: (len(shards[shard]), shard))
+        shards[target].extend(chunk)
+    return shards[shard_index - 1]
+
+def get_team_slug(team_id):
+    """ Team id as used in the file names of logos and iCal feeds """
+    return team_id.lower().replace(' ', '_')
+
+def is_dated_file(file, prefix, suffix):
+    """ Check if file is exactly prefix_YYYY-MM-DD + suffix (EHV DS1 must not match EHV DS10) """
+    return bool(re.fullmatch(rf'{re.escape(prefix)}_\d{{4}}-\d{{2}}-\d{{2}}{re.escape(suffix)}', file))
+
+def is_team_file(file, team_id):
+    """ Check if a docs file belongs to a team: schedules, PDFs, flag file or iCal feed """
+    return any(is_dated_file(file, f'{kind}_{team_id}', suffix)
+               for kind in ('Rijschema', 'Drivingschedule') for suffix in ('.md', '.pdf')) or \
+        file in (f'.convert_to_pdf_{team_id}.flag', f'{get_team_slug(team_id)}.ics')
+
+def get_run_report_path(docs_dir, shard=None):
+    """ Get the run report path, one file per shard """
+    if shard is None:
+        return os.path.join(docs_dir, 'run_report.json')
+    shard_index, shard_count = shard
+    return os.path.join(docs_dir, f'run_report.shard-{shard_index}-of-{shard_count}.json')
+
+def write_run_report(docs_dir, shard, results):
+    """ Write the outcome per team of this run as JSON """
+    os.makedirs(docs_dir, exist_ok=True)
+    report_path = get_run_report_path(docs_dir, shard)
+    report = {
+        'shard': f'{shard[0]}/{shard[1]}' if shard else None,
+        'teams': dict(sorted(results.items())),
+    }
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+    print(f'  Run report written: {report_path}')
+    return report_path